@@ -4,6 +4,7 @@ Uso:
 """
 
 import socket
+import select
 import argparse
 import struct
 import uuid
@@ -11,8 +12,10 @@ import zlib
 import random
 import time
 import logging
+import mmap
 import os
-from typing import Dict, Set, Tuple
+import sys
+from typing import List, Tuple
 
 # --- Configuração de logs ---
 logging.basicConfig(level=logging.INFO,
@@ -24,39 +27,259 @@ MAGIC_NUMBER = 0x0000
 MAX_PAYLOAD  = 1500
 HEADER_SIZE  = 18
 MAX_RETRIES  = 3
+SOCK_BUF     = 12 * 1024 * 1024   # SO_RCVBUF/SO_SNDBUF desejado
+RECV_BATCH   = 32                 # datagramas drenados por espera
+RESEND_WINDOW = 32                # RESENDs enviados antes de esperar respostas
+BUSY_POLL_US = 50                 # SO_BUSY_POLL (Linux), em microssegundos
+PROGRESS_EVERY = 1000            # segmentos entre linhas de progresso (INFO)
+PROGRESS_SECS  = 0.5             # ... ou intervalo máximo entre elas, se houve avanço
+SO_BUSY_POLL = getattr(socket, 'SO_BUSY_POLL', 46)
+SOL_UDP      = getattr(socket, 'SOL_UDP', 17)
+UDP_SEGMENT  = getattr(socket, 'UDP_SEGMENT', 103)   # GSO de UDP (Linux >= 4.18)
 
 TYPE_REQ, TYPE_DATA, TYPE_ACK, TYPE_ERR = 0,1,2,3
 
+# formatos compilados uma vez: MAGIC TYPE SEQ SIZE TOTAL FLAGS [CRC]
+_HDR    = struct.Struct('!HBIHIBI')
+_HDR_NC = struct.Struct('!HBIHIB')
+_U32    = struct.Struct('!I')
+_GSO    = struct.pack('=H', HEADER_SIZE)   # cmsg UDP_SEGMENT: cada ACK vira um datagrama
 
 
-def compute_checksum(data: bytes) -> bytes:
-    return struct.pack('!I', zlib.crc32(data) & 0xFFFFFFFF)
+def compute_checksum(data: bytes, value: int = 0) -> bytes:
+    return _U32.pack(zlib.crc32(data, value) & 0xFFFFFFFF)
+
+
+# CRC parcial dos campos fixos do ACK (MAGIC, TYPE); só seq muda por pacote
+_ACK_PREFIX = struct.pack('!HB', MAGIC_NUMBER, TYPE_ACK)
+_ACK_PREFIX_CRC = zlib.crc32(_ACK_PREFIX)
 
 
 class UDPClient:
     def __init__(self, loss: int):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.settimeout(2.0)
+        self.sock.setblocking(False)
+        self.timeout = 2.0
+        self.set_buffers(SOCK_BUF)
+        self.set_busy_poll(BUSY_POLL_US)
         self.loss_rate = loss
-        self.segments: Dict[int, bytes] = {}
         self.start_time = None
+        # o arquivo de saída é mapeado em memória: segmento i fica em
+        # image[i*seg_size:], exceto o último, guardado à parte até o fim
+        # (tamanho variável)
+        self.total = 0
+        self.out = None
+        self.image = None
+        self.seg_size = 0
+        self.last = b''
+        self.received = bytearray()
+        self.count = 0
+        self.logged = 0           # count na última linha de progresso
+        self.next_progress = 0.0  # instante (monotonic) da próxima por tempo
+        # ACK pré-montado: só seq e CRC são reescritos a cada envio
+        self.ack_buf = bytearray(_ACK_PREFIX + bytes(HEADER_SIZE - len(_ACK_PREFIX)))
+        self.ack_tail = memoryview(self.ack_buf)[len(_ACK_PREFIX):HEADER_SIZE-4]
+        self.acks = bytearray()   # ACKs acumulados durante um lote
+        self.gso = sys.platform.startswith('linux') and hasattr(self.sock, 'sendmsg')
+        # pool fixo de buffers de recepção, reaproveitado a cada lote
+        self.pool = [memoryview(bytearray(MAX_PAYLOAD + HEADER_SIZE))
+                     for _ in range(RECV_BATCH)]
+
+    def set_buffers(self, size: int):
+        # buffers pequenos fazem o kernel descartar rajadas, o que vira RESEND
+        for opt, name in ((socket.SO_RCVBUF, 'SO_RCVBUF'), (socket.SO_SNDBUF, 'SO_SNDBUF')):
+            self.sock.setsockopt(socket.SOL_SOCKET, opt, size)
+            got = self.sock.getsockopt(socket.SOL_SOCKET, opt)
+            if got < size:
+                logging.warning(f"{name} limitado pelo kernel a {got}B "
+                                f"(ajuste sysctl net.core.rmem_max/wmem_max)")
+
+    def set_busy_poll(self, usec: int):
+        # faz o kernel consultar a placa por até usec antes de dormir no recv,
+        # encurtando a ida-e-volta do RESEND; só existe no Linux e pode exigir
+        # CAP_NET_ADMIN (alternativa: sysctl net.core.busy_poll)
+        if not sys.platform.startswith('linux'):
+            return
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_BUSY_POLL, usec)
+        except OSError as e:
+            logging.debug(f"SO_BUSY_POLL indisponível: {e}")
+
+    def recv_batch(self, max_batch: int = RECV_BATCH) -> List[memoryview]:
+        """Espera o primeiro datagrama (até self.timeout) e drena, sem esperar,
+        os que já estiverem na fila do socket. Levanta socket.timeout se nada chegar.
+
+        As views apontam para self.pool e só valem até a próxima chamada."""
+        batch = []
+        while len(batch) < max_batch:
+            buf = self.pool[len(batch)]
+            try:
+                batch.append(buf[:self.sock.recv_into(buf)])
+            except ConnectionError:
+                # ICMP de porta inalcançável em socket conectado; segue esperando
+                logging.warning("Servidor inalcançável")
+                continue
+            except BlockingIOError:
+                if batch:
+                    break
+                if not select.select([self.sock], [], [], self.timeout)[0]:
+                    raise socket.timeout
+        return batch
 
     def parse_target(self, target: str) -> Tuple[str,int,str]:
         ipport, fname = target.split('/', 1)
         ip, port = ipport.split(':')
         return ip, int(port), fname
 
+    def begin(self, total: int, path: str):
+        self.total = total
+        self.received = bytearray(total)
+        self.count = 0
+        self.next_progress = time.monotonic() + PROGRESS_SECS
+        self.out = open(path, 'w+b')
+
+    def store(self, seq: int, payload: memoryview) -> bool:
+        """Grava o segmento; devolve False se ele já tinha chegado."""
+        if self.received[seq]:
+            return False
+        if seq == self.total - 1:
+            self.last = bytes(payload)
+        else:
+            if self.image is None:
+                # todo segmento que não é o último tem o tamanho cheio
+                self.seg_size = len(payload)
+                size = self.seg_size * (self.total - 1)
+                self.out.truncate(size)
+                if hasattr(os, 'posix_fallocate'):
+                    # reserva os blocos já: sem isso cada página tocada pela
+                    # primeira vez aloca disco dentro do laço de recepção
+                    os.posix_fallocate(self.out.fileno(), 0, size)
+                self.image = mmap.mmap(self.out.fileno(), size)
+            off = seq * self.seg_size
+            self.image[off:off + len(payload)] = payload
+        self.received[seq] = 1
+        self.count += 1
+        return True
+
+    def progress(self):
+        # uma linha por avanço real, no máximo a cada PROGRESS_SECS por tempo
+        self.next_progress = time.monotonic() + PROGRESS_SECS
+        if self.count != self.logged:
+            self.logged = self.count
+            logging.info(f"Progresso: {self.count}/{self.total} segmentos")
+
+    def missing(self) -> List[int]:
+        out, i = [], self.received.find(0)
+        while i != -1:
+            out.append(i)
+            i = self.received.find(0, i + 1)
+        return out
+
+    def finish(self):
+        """Fecha o arquivo; se faltar segmento, compacta os recebidos no início."""
+        end = 0
+        if self.image is not None:
+            if self.count == self.total:
+                end = len(self.image)
+            else:
+                seg = self.seg_size
+                for i in range(self.total - 1):
+                    if self.received[i]:
+                        if end != i * seg:
+                            self.image[end:end + seg] = self.image[i*seg:(i+1)*seg]
+                        end += seg
+            self.image.flush()
+            self.image.close()
+        self.out.seek(end)
+        self.out.write(self.last)
+        self.out.truncate()
+        self.out.close()
+
     def make_request(self, text: str) -> bytes:
-        hdr = struct.pack('!HBIHIB',
-                          MAGIC_NUMBER, TYPE_REQ, 0,
-                          len(text), 0, 0)
-        return hdr + compute_checksum(hdr + text.encode()) + text.encode()
+        body = text.encode()
+        hdr = _HDR_NC.pack(MAGIC_NUMBER, TYPE_REQ, 0, len(body), 0, 0)
+        return hdr + compute_checksum(body, zlib.crc32(hdr)) + body
+
+    def make_ack(self, seq: int) -> bytearray:
+        # o buffer é reaproveitado: enviar antes da próxima chamada
+        _U32.pack_into(self.ack_buf, 3, seq)
+        _U32.pack_into(self.ack_buf, HEADER_SIZE-4, zlib.crc32(self.ack_tail, _ACK_PREFIX_CRC))
+        return self.ack_buf
+
+    def send(self, data):
+        try:
+            self.sock.send(data)
+        except BlockingIOError:
+            # socket não bloqueante com buffer de envio cheio: também é perda
+            logging.warning("Buffer de envio cheio, pacote descartado")
+        except ConnectionError:
+            # ICMP pendente no socket conectado também aparece no envio:
+            # conta como perda, quem espera a resposta decide o que fazer
+            logging.warning("Servidor inalcançável")
+
+    def recover(self, missing: List[int]):
+        """Pede os segmentos faltantes em janelas de RESEND_WINDOW RESENDs seguidos
+        e drena as respostas; o que não chegar volta na rodada seguinte."""
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        for attempt in range(1, MAX_RETRIES+1):
+            if attempt > 1:
+                missing = self.missing()
+                if not missing:
+                    return
+            for i in range(0, len(missing), RESEND_WINDOW):
+                wanted = set(missing[i:i+RESEND_WINDOW])
+                for seq in sorted(wanted):
+                    self.send(self.make_request(f"RESEND {seq}"))
+                while wanted:
+                    try:
+                        batch = self.recv_batch()
+                    except socket.timeout:
+                        logging.warning(f"Tentativa {attempt}/{MAX_RETRIES} sem resposta "
+                                        f"para seqs {sorted(wanted)}")
+                        break
+                    for data in batch:
+                        magic, ptype, seq, size, _, _, crc = _HDR.unpack_from(data)
+                        payload = data[HEADER_SIZE:HEADER_SIZE+size]
+                        if magic == MAGIC_NUMBER and ptype == TYPE_DATA and seq < self.total \
+                           and zlib.crc32(payload, zlib.crc32(data[:HEADER_SIZE-4])) == crc:
+                            # todo DATA válido recebe ACK, mesmo fora desta janela de
+                            # RESEND: é retransmissão do servidor por ACK perdido, e sem
+                            # ACK a janela dele fica presa nesse seq até esgotar retries
+                            self.acks += self.make_ack(seq)
+                            if self.store(seq, payload) and debug:
+                                logging.debug(f"Recuperado segmento {seq}")
+                            wanted.discard(seq)
+                        else:
+                            logging.warning(f"Resposta inesperada ou CRC inválido no reenvio de seq {seq}")
+                    self.flush_acks()
+        missing = self.missing()
+        if missing:
+            logging.error(f"Falha ao recuperar segmentos {missing} após {MAX_RETRIES} tentativas")
 
-    def make_ack(self, seq: int) -> bytes:
-        hdr = struct.pack('!HBIHIB',
-                          MAGIC_NUMBER, TYPE_ACK, seq,
-                          0, 0, 0)
-        return hdr + compute_checksum(hdr)
+    def flush_acks(self):
+        """Envia os ACKs acumulados; com GSO vão todos num único sendmsg,
+        que o kernel separa em datagramas de HEADER_SIZE bytes."""
+        acks = self.acks
+        if len(acks) > HEADER_SIZE and self.gso:
+            try:
+                self.sock.sendmsg([acks], [(SOL_UDP, UDP_SEGMENT, _GSO)])
+                acks.clear()
+                return
+            except BlockingIOError:
+                # EAGAIN não é falta de suporte: o lote se perde, o GSO continua
+                logging.warning("Buffer de envio cheio, ACKs descartados")
+                acks.clear()
+                return
+            except ConnectionError:
+                logging.warning("Servidor inalcançável")
+                acks.clear()
+                return
+            except OSError as e:
+                logging.debug(f"UDP_SEGMENT indisponível, enviando um a um: {e}")
+                self.gso = False
+        for off in range(0, len(acks), HEADER_SIZE):
+            self.send(acks[off:off+HEADER_SIZE])
+        acks.clear()
 
     def start(self, command: str, target: str):
         if command.upper() != 'GET':
@@ -64,110 +287,105 @@ class UDPClient:
             return
 
         ip, port, fname = self.parse_target(target)
-        addr = (ip, port)
+        # socket conectado: o kernel não revalida o endereço a cada envio
+        # e descarta datagramas de outros remetentes
+        self.sock.connect((ip, port))
         os.makedirs('received', exist_ok=True)
         uid = uuid.uuid4().hex[:8]
 
+        out = os.path.join('received', f"{uid}_{fname}")
+
         logging.info(f"Conectando a {ip}:{port} para baixar '{fname}'")
         # envia GET
-        self.sock.sendto(self.make_request(f"GET /{fname}"), addr)
+        self.sock.send(self.make_request(f"GET /{fname}"))
         self.start_time = time.time()
-        total = None
 
         # 1) recepção inicial
-        while True:
+        # nomes locais evitam buscas de atributo/global a cada pacote
+        unpack, crc32 = _HDR.unpack_from, zlib.crc32
+        acks, make_ack, store = self.acks, self.make_ack, self.store
+        loss = self.loss_rate
+        # log por pacote só em DEBUG (-v); em INFO fica uma linha a cada
+        # PROGRESS_EVERY segmentos novos ou PROGRESS_SECS
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        done = False
+        while not done:
             try:
-                packet, _ = self.sock.recvfrom(MAX_PAYLOAD + HEADER_SIZE)
+                batch = self.recv_batch()
             except socket.timeout:
                 logging.warning("Timeout de recepção (possível fim de envio)")
                 break
 
-            header = packet[:HEADER_SIZE]
-            magic, ptype, seq, size, tot, flags, recv_crc = struct.unpack('!HBIHIB4s', header)
-            payload = packet[HEADER_SIZE:HEADER_SIZE+size]
+            for packet in batch:
+                magic, ptype, seq, size, tot, flags, recv_crc = unpack(packet)
+                payload = packet[HEADER_SIZE:HEADER_SIZE+size]
 
-            if magic != MAGIC_NUMBER:
-                continue
+                if magic != MAGIC_NUMBER:
+                    continue
 
-            # integridade
-            if compute_checksum(header[:-4] + payload) != recv_crc:
-                logging.warning(f"Corrupção no segmento {seq}")
-                self.sock.sendto(self.make_ack(seq), addr)
-                continue
+                # integridade
+                if crc32(payload, crc32(packet[:HEADER_SIZE-4])) != recv_crc:
+                    logging.warning(f"Corrupção no segmento {seq}")
+                    acks += make_ack(seq)
+                    continue
 
-            # simula perda
-            if random.randint(1,100) <= self.loss_rate:
-                logging.warning(f"Simulação de perda: descartou segmento {seq}")
-                self.sock.sendto(self.make_ack(seq), addr)
-                continue
+                # simula perda (random.random é uma só chamada em C; randint não)
+                if loss and random.random() * 100 < loss:
+                    logging.warning(f"Simulação de perda: descartou segmento {seq}")
+                    acks += make_ack(seq)
+                    continue
 
-            if ptype == TYPE_DATA:
-                if total is None:
-                    total = tot
-                    logging.info(f"Esperando {total} segmentos...")
-                logging.info(f"Recebido segmento {seq}/{total-1}")
-                self.sock.sendto(self.make_ack(seq), addr)
-                self.segments.setdefault(seq, payload)
-                if len(self.segments) == total:
-                    logging.info("Todos os segmentos recebidos")
-                    break
+                if ptype == TYPE_DATA:
+                    if not self.total:
+                        self.begin(tot, out)
+                        logging.info(f"Esperando {tot} segmentos...")
+                    if debug:
+                        logging.debug(f"Recebido segmento {seq}/{self.total-1}")
+                    acks += make_ack(seq)
+                    if store(seq, payload) and self.count % PROGRESS_EVERY == 0:
+                        self.progress()
+                    if self.count == self.total:
+                        logging.info("Todos os segmentos recebidos")
+                        done = True
+                        break
 
-            elif ptype == TYPE_ERR:
-                logging.error(f"Erro do servidor: {payload.decode()}")
-                return
+                elif ptype == TYPE_ERR:
+                    logging.error(f"Erro do servidor: {bytes(payload).decode()}")
+                    return
+            self.flush_acks()
+            # por tempo: checado uma vez por lote, não por pacote
+            if self.total and time.monotonic() >= self.next_progress:
+                self.progress()
 
-        if total is None:
+        if not self.total:
             logging.error("Não recebeu metadados de total de segmentos.")
             return
 
         # 2) recuperação
-        missing = sorted(set(range(total)) - set(self.segments.keys()))
-        if missing:
-            logging.info(f"Segmentos faltantes: {missing}")
-            ans = input("Recuperar perdidos? (s/n): ")
-            if ans.lower().startswith('s'):
-                for seq in missing:
-                    recovered = False
-                    for attempt in range(1, MAX_RETRIES+1):
-                        # envia RESEND
-                        self.sock.sendto(self.make_request(f"RESEND {seq}"), addr)
-                        try:
-                            data, _ = self.sock.recvfrom(MAX_PAYLOAD + HEADER_SIZE)
-                        except socket.timeout:
-                            logging.warning(f"Tentativa {attempt}/{MAX_RETRIES} sem resposta para seq {seq}")
-                            continue
-
-                        h2 = data[:HEADER_SIZE]
-                        magic2, ptype2, seq2, size2, _, _, crc2 = struct.unpack('!HBIHIB4s', h2)
-                        p2 = data[HEADER_SIZE:HEADER_SIZE+size2]
-                        if magic2 == MAGIC_NUMBER and ptype2 == TYPE_DATA \
-                           and seq2 == seq and compute_checksum(h2[:-4]+p2) == crc2:
-                            logging.info(f"Recuperado segmento {seq2}")
-                            self.sock.sendto(self.make_ack(seq2), addr)
-                            self.segments[seq2] = p2
-                            recovered = True
-                            break
-                        else:
-                            logging.warning(f"Resposta inesperada ou CRC inválido no reenvio de seq {seq}")
-                    if not recovered:
-                        logging.error(f"Falha ao recuperar segmento {seq} após {MAX_RETRIES} tentativas")
-            else:
-                # grava parcial
-                out = os.path.join('received', f"{uid}_{fname}")
-                with open(out, 'wb') as f:
-                    for i in sorted(self.segments):
-                        f.write(self.segments[i])
-                logging.info(f"Arquivo parcial salvo em {out}")
-                return
-
-        # 3) montagem final
-        out = os.path.join('received', f"{uid}_{fname}")
-        with open(out, 'wb') as f:
-            for i in range(total):
-                f.write(self.segments[i])
+        missing = self.missing()
+        partial = False
+        try:
+            if missing:
+                logging.info(f"Segmentos faltantes: {missing}")
+                ans = input("Recuperar perdidos? (s/n): ")
+                if ans.lower().startswith('s'):
+                    self.recover(missing)
+                else:
+                    partial = True
+        finally:
+            # 3) montagem final; roda mesmo se a recuperação falhar, senão o
+            # arquivo fica no tamanho pré-alocado, cheio de zeros
+            self.finish()
+        if partial:
+            logging.info(f"Arquivo parcial salvo em {out}")
+            return
+        if self.count < self.total:
+            logging.error(f"Arquivo incompleto salvo em {out}: "
+                          f"{self.total - self.count} segmentos não recuperados")
+            return
         duration = time.time() - self.start_time
         logging.info(f"Arquivo completo salvo em {out}")
-        logging.info(f"Transferência concluída em {duration:.2f}s, {total} segmentos, "
+        logging.info(f"Transferência concluída em {duration:.2f}s, {self.total} segmentos, "
                      f"{len(missing)} recuperados")
 
 
@@ -176,7 +394,10 @@ if __name__ == '__main__':
     parser.add_argument('command', choices=['GET'], help="Comando de requisição (GET)")
     parser.add_argument('target', help="Formato IP:Port/arquivo.ext")
     parser.add_argument('--loss', type=int, default=0, help="Taxa de perda (%)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Log de cada segmento")
     args = parser.parse_args()
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
 
     client = UDPClient(args.loss)
     client.start(args.command, args.target)
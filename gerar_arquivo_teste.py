@@ -1,6 +1,4 @@
 import os
-import random
-import string
 
 def gerar_arquivo_teste(nome_arquivo: str, tamanho_mb: int):
     """Gera um arquivo de teste com o tamanho especificado em MB"""
@@ -8,17 +6,16 @@ def gerar_arquivo_teste(nome_arquivo: str, tamanho_mb: int):
     
     print(f"Gerando arquivo de teste de {tamanho_mb}MB...")
     
-    with open(nome_arquivo, 'wb') as f:
+    # escreve num temporário e troca no fim: o servidor mapeia os arquivos em
+    # memória, e truncar um arquivo mapeado derruba o processo (SIGBUS)
+    temporario = nome_arquivo + '.tmp'
+    with open(temporario, 'wb') as f:
         bytes_escritos = 0
         tamanho_bloco = 1024 * 1024  # Escreve 1MB por vez
         
         while bytes_escritos < tamanho_bytes:
-            # Gera dados aleatórios
-            dados = ''.join(random.choices(string.ascii_letters + string.digits, k=tamanho_bloco)).encode()
-            
-            # Ajusta o último bloco se necessário
-            if bytes_escritos + len(dados) > tamanho_bytes:
-                dados = dados[:tamanho_bytes - bytes_escritos]
+            # Gera dados aleatórios (o último bloco já sai no tamanho certo)
+            dados = os.urandom(min(tamanho_bloco, tamanho_bytes - bytes_escritos))
                 
             f.write(dados)
             bytes_escritos += len(dados)
@@ -26,6 +23,7 @@ def gerar_arquivo_teste(nome_arquivo: str, tamanho_mb: int):
             # Mostra progresso
             progresso = (bytes_escritos / tamanho_bytes) * 100
             print(f"\rProgresso: {progresso:.1f}%", end='')
+    os.replace(temporario, nome_arquivo)
             
     print(f"\nArquivo {nome_arquivo} ({tamanho_mb}MB) gerado com sucesso!")
 
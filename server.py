@@ -1,10 +1,11 @@
 """
 Uso:
   python server.py 5000
+  python server.py 5000 -w 4    # 4 processos na mesma porta (Linux)
 
 """
 
-import socket, threading, queue, os, struct, zlib, time, logging
+import socket, selectors, heapq, itertools, collections, errno, mmap, os, signal, stat, sys, struct, zlib, time, logging
 from typing import Tuple, Dict
 
 logging.basicConfig(level=logging.INFO,
@@ -14,40 +15,135 @@ logging.basicConfig(level=logging.INFO,
 MTU, IP_HDR, UDP_HDR = 1500, 20, 8
 MAGIC = 0x0000
 HDR_FMT = '!HBIHIB4s'  # MAGIC(2) TYPE(1) SEQ(4) SIZE(2) TOTAL(4) FLAGS(1) CRC(4)
-HDR_SZ = struct.calcsize(HDR_FMT)
+_HDR = struct.Struct(HDR_FMT)           # compilados uma vez, sem reparse por pacote
+_HDR_NOCRC = struct.Struct('!HBIHIB')
+_HDR_RX = struct.Struct('!HBIHIBI')    # recebidos: CRC como inteiro, comparado sem empacotar
+_U32 = struct.Struct('!I')
+_SEQ_SIZE = struct.Struct('!IH')       # só SEQ e SIZE (offset 3) num cabeçalho já montado
+HDR_SZ = _HDR.size
 MAX_PAYLOAD = MTU - IP_HDR - UDP_HDR - HDR_SZ
+DGRAM_SZ = HDR_SZ + MAX_PAYLOAD
 
 TIMEOUT      = 2.0
 MAX_RETRIES  = 3
+FILE_CACHE   = 32     # arquivos mapeados mantidos abertos entre transferências
 RECOVER_WIN  = 5.0    # segundos para aceitar RESENDs pós-FLAG_LAST
-LATENCY      = 0.05
+PACING       = 0.0    # intervalo mínimo entre envios por cliente (s); 0 desliga
+WINDOW       = 32     # segmentos em voo sem ACK por cliente
+CRC_BLOCK    = (1<<20)//MAX_PAYLOAD   # segmentos (~1 MB) por rodada de CRC adiantado
+RECV_BATCH   = 64     # datagramas lidos por volta do laço antes de checar timers
+GSO_SEGS     = 65507 // DGRAM_SZ   # limite do UDP_SEGMENT: o lote cabe num datagrama IP
+BATCH        = min(GSO_SEGS,WINDOW)   # segmentos por sendmsg; mais que a janela nunca há em voo
 
 TYPE_REQ, TYPE_DATA, TYPE_ACK, TYPE_ERR = 0,1,2,3
 FLAG_NORMAL, FLAG_LAST = 0,1
 
-def crc32(data: bytes) -> bytes:
-    return struct.pack('!I', zlib.crc32(data) & 0xFFFFFFFF)
+HAS_SENDMSG = hasattr(socket.socket,'sendmsg')   # não existe no Windows
+HAS_MADVISE = hasattr(mmap,'MADV_SEQUENTIAL')      # idem (e Python < 3.8)
+# só o Linux distribui datagramas unicast entre sockets com SO_REUSEPORT;
+# no macOS/BSD um socket só recebe tudo e os outros workers ficariam ociosos
+HAS_REUSEPORT = (hasattr(socket,'SO_REUSEPORT') and hasattr(os,'fork')
+                 and sys.platform.startswith('linux'))
+SOL_UDP     = getattr(socket,'SOL_UDP',17)
+UDP_SEGMENT = getattr(socket,'UDP_SEGMENT',103)    # GSO de UDP (Linux >= 4.18)
+# erros do sendmsg com UDP_SEGMENT que indicam falta de suporte (kernel/placa)
+GSO_UNSUPPORTED = {errno.EINVAL, errno.EOPNOTSUPP, errno.ENOPROTOOPT, errno.EIO}
+_GSO = struct.pack('=H',DGRAM_SZ)   # cmsg UDP_SEGMENT: o kernel fatia o lote em datagramas DATA
 
-class ClientHandler(threading.Thread):
-    def __init__(self, server, addr, q):
-        super().__init__(daemon=True)
+def crc32(*parts) -> bytes:
+    # encadeia o CRC pelas partes em vez de concatená-las antes
+    c=0
+    for part in parts: c=zlib.crc32(part,c)
+    return _U32.pack(c)
+
+# path -> (mtime_ns, tamanho, mmap, crcs, have), do menos ao mais recente
+_files = collections.OrderedDict()
+
+def map_file(path, fst):
+    """Mapeamento do arquivo, compartilhado por todas as transferências, com
+    a tabela de CRCs por segmento: o cabeçalho DATA do seg i só depende do
+    arquivo, então o CRC vale para qualquer cliente. crcs guarda 4 bytes por
+    segmento e have marca os já calculados (~5 bytes/segmento no total)."""
+    e = _files.get(path)
+    if e is None or e[0]!=fst.st_mtime_ns or e[1]!=fst.st_size:
+        # arquivo novo ou alterado: a entrada antiga sai do cache e o mapeamento
+        # é liberado quando o último cliente que o usa terminar
+        size = fst.st_size
+        total = (size + MAX_PAYLOAD-1)//MAX_PAYLOAD
+        mm = b''
+        if size:
+            with open(path,'rb') as f:
+                mm = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+            if HAS_MADVISE:
+                # leitura linear: readahead agressivo e pré-carga da primeira janela
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+                mm.madvise(mmap.MADV_WILLNEED,0,min(size,WINDOW*MAX_PAYLOAD))
+        e = _files[path] = (fst.st_mtime_ns, size, mm, bytearray(4*total), bytearray(total))
+    _files.move_to_end(path)
+    while len(_files)>FILE_CACHE: _files.popitem(last=False)
+    return e[2:]
+
+def forget_file(path):
+    # arquivo sumiu: não mantém o mapeamento do inode apagado
+    _files.pop(path, None)
+
+def seg_crcs(mv, crcs, have, total, lo, hi):
+    # preenche a tabela para [lo,hi) num laço só, com tudo em locais
+    h = bytearray(_HDR_NOCRC.size); pack = _HDR_NOCRC.pack_into
+    crc, put = zlib.crc32, _U32.pack_into
+    i = have.find(0, lo, hi)
+    while i != -1:
+        chunk = mv[i*MAX_PAYLOAD:(i+1)*MAX_PAYLOAD]
+        pack(h, 0, MAGIC, TYPE_DATA, i, len(chunk), total, FLAG_LAST if i==total-1 else FLAG_NORMAL)
+        put(crcs, 4*i, crc(chunk,crc(h)))
+        have[i] = 1
+        i = have.find(0, i+1, hi)
+
+class ClientState:
+    """Estado de uma transferência em curso; __slots__ evita o dict por
+    instância e deixa o acesso aos campos mais barato que st['campo']."""
+    __slots__ = ('mm','mv','total','base','next','acked','retries',
+                 'last_send','next_send_at','last_seq','crc','have','ready')
+
+    def __init__(self, mm, crcs, have, total):
+        self.mm = mm
+        self.mv = memoryview(mm)
+        self.total = total
+        # janela deslizante: [base, next) enviados e ainda sem ACK
+        self.base = 0
+        self.next = 0
+        self.acked = bytearray(total)
+        self.retries = 0
+        self.last_send = time.monotonic()   # início conta como envio p/ o TIMEOUT
+        self.next_send_at = 0.0   # liberação do próximo envio quando PACING > 0
+        self.last_seq = total-1
+        # CRC de cada segmento (cabeçalho+dados), compartilhado via map_file:
+        # retransmissões e outros clientes do mesmo arquivo só reusam
+        self.crc = memoryview(crcs)
+        self.have = have
+        self.ready = 0   # CRCs adiantados por prefetch até aqui (exclusivo)
+
+class ClientHandler:
+    """Estado de uma transferência; é dirigido pelo laço único do UDPServer
+    (handle para cada pacote do cliente, on_timer quando vence o prazo)."""
+    def __init__(self, server, addr):
         self.srv = server
         self.addr = addr
-        self.q = q
         self.state = None
         self.finished_at = None
+        self.last_rx = 0.0
+        self.pending = False   # próximo envio adiado pelo espaçamento PACING
+        self.deadline = None   # instante do próximo on_timer
+        self.armed = None      # instante da entrada viva deste handler no heap
+        # cabeçalhos DATA de um lote (um slot por segmento), montados em start
+        self.hdr = memoryview(bytearray(BATCH*_HDR_NOCRC.size))
+        self.slots = None
 
-    def run(self):
-        # 1) espera REQUEST
-        try:
-            pkt = self.q.get(timeout=TIMEOUT)
-        except queue.Empty:
-            logging.error(f"{self.addr}: sem REQUEST, abortando")
-            return self.cleanup()
-
-        h,p = pkt[:HDR_SZ], pkt[HDR_SZ:]
-        magic, ptype, _, size, _, _, _ = struct.unpack(HDR_FMT, h)
-        if magic!=MAGIC or ptype!=TYPE_REQ:
+    def start(self, pkt):
+        # 1) primeiro pacote tem de ser o REQUEST
+        p = bytes(pkt[HDR_SZ:])   # pkt é view do buffer de recepção
+        ptype, size = pkt[2], int.from_bytes(pkt[7:9],'big')
+        if ptype!=TYPE_REQ:
             logging.error(f"{self.addr}: primeiro pacote inválido")
             return self.cleanup()
 
@@ -58,141 +154,303 @@ class ClientHandler(threading.Thread):
 
         fname = text[1].lstrip('/')
         path = os.path.join(self.srv.directory, fname)
-        if not os.path.exists(path):
+        try: fst = os.stat(path)   # um stat só: existência, tipo, tamanho e mtime
+        except OSError: fst = None
+        if fst is None or not stat.S_ISREG(fst.st_mode):
+            forget_file(path)
             self.srv.send_error(self.addr, f"'{fname}' não encontrado")
             return self.cleanup()
 
         # 2) inicializa estado
-        sz = os.path.getsize(path)
+        sz = fst.st_size
         total = (sz + MAX_PAYLOAD-1)//MAX_PAYLOAD
-        f = open(path,'rb')
-        self.state = {
-            'file': f,
-            'total': total,
-            'current': 0,
-            'retries': 0,
-            'last_send': 0.0,
-            'last_seq': total-1
-        }
+        # arquivo mapeado: segmentos saem do page cache sem seek/read por envio
+        self.state = ClientState(*map_file(path, fst), total)
+        # MAGIC, TYPE, TOTAL e FLAGS não mudam durante a transferência: ficam
+        # gravados nos slots, e cada envio só reescreve SEQ e SIZE
+        hsz = _HDR_NOCRC.size
+        for k in range(BATCH):
+            _HDR_NOCRC.pack_into(self.hdr, k*hsz, MAGIC, TYPE_DATA, 0, 0, total, FLAG_NORMAL)
+        self.slots = [self.hdr[k*hsz:(k+1)*hsz] for k in range(BATCH)]
         logging.info(f"{self.addr}: enviando '{fname}' ({sz}B em {total} segs)")
-        self.send_next()
+        self.fill()
+        self.rearm()
 
-        # 3) loop: ACKs, RESEND, timeout
-        while True:
-            # se último ACK recebido, abre janela de RESEND
-            if self.finished_at:
-                try:
-                    pkt = self.q.get(timeout=RECOVER_WIN)
-                except queue.Empty:
-                    logging.info(f"{self.addr}: tempo de recuperação esgotado")
-                    break
+    def handle(self, pkt):
+        # 3) ACKs e RESENDs
+        if self.state is None:
+            return self.start(pkt)
+        self.last_rx = time.monotonic()
+
+        _, ptype, seq, size, _, flags, crc_recv = _HDR_RX.unpack_from(pkt)
+        payload = pkt[HDR_SZ:HDR_SZ+size]
+        # MAGIC e tipo já filtrados em drain; aqui só o CRC
+        # ACK/REQ são curtos: zlib.crc32 direto, sem o encadeamento genérico de crc32()
+        if zlib.crc32(payload,zlib.crc32(pkt[:HDR_SZ-4]))!=crc_recv:
+            logging.warning(f"{self.addr}: CRC inválido")
+        elif ptype==TYPE_ACK:
+            if self.srv.debug: logging.debug(f"{self.addr}: ACK seq={seq}")
+            self.handle_ack(seq)
+
+        elif ptype==TYPE_REQ:
+            txt = bytes(payload).decode().strip().split()
+            if txt[0].upper()=='RESEND':
+                seqr = int(txt[1])
+                if self.srv.debug: logging.debug(f"{self.addr}: RESEND seq={seqr}")
+                self.resend_segment(seqr)
             else:
-                try:
-                    pkt = self.q.get(timeout=TIMEOUT)
-                except queue.Empty:
-                    if not self.retransmit():
-                        logging.error(f"{self.addr}: retries excedidos")
-                        break
-                    continue
-
-            h = pkt[:HDR_SZ]; b = pkt[HDR_SZ:]
-            magic, ptype, seq, size, _, flags, crc_recv = struct.unpack(HDR_FMT, h)
-            payload = b[:size]
-            if magic!=MAGIC or crc32(h[:-4]+payload)!=crc_recv:
-                logging.warning(f"{self.addr}: CRC/magic inválido")
-                continue
+                logging.warning(f"{self.addr}: REQUEST inesperado: {txt!r}")
+        self.rearm()
 
-            if ptype==TYPE_ACK:
-                logging.info(f"{self.addr}: ACK seq={seq}")
-                # se é o ACK do último segmento, marca finish
-                if seq==self.state['last_seq']:
-                    self.finished_at = time.time()
-                    logging.info(f"{self.addr}: ACK de FLAG_LAST recebido")
-                self.handle_ack(seq)
-
-            elif ptype==TYPE_REQ:
-                txt = payload.decode().strip().split()
-                if txt[0].upper()=='RESEND':
-                    seqr = int(txt[1])
-                    logging.info(f"{self.addr}: RESEND seq={seqr}")
-                    self.resend_segment(seqr)
-                else:
-                    logging.warning(f"{self.addr}: REQUEST inesperado: {txt!r}")
-
-        self.cleanup()
-
-    def send_next(self):
-        st = self.state; i,tot = st['current'], st['total']
-        if i>=tot: return
-        f=st['file']; f.seek(i*MAX_PAYLOAD)
-        chunk=f.read(MAX_PAYLOAD)
-        fl = FLAG_LAST if i==tot-1 else FLAG_NORMAL
-
-        h = struct.pack('!HBIHIB', MAGIC, TYPE_DATA, i, len(chunk), tot, fl)
-        pkt = h + crc32(h+chunk) + chunk
-        self.srv.socket.sendto(pkt, self.addr)
-        
-        st['last_send']=time.time()
-        logging.info(f"{self.addr}: enviado seg {i}/{tot-1}")
-        time.sleep(LATENCY)
+    def on_timer(self):
+        if self.pending:
+            self.pending = False
+            self.fill()
+        elif self.finished_at:
+            logging.info(f"{self.addr}: tempo de recuperação esgotado")
+            return self.cleanup()
+        elif not self.retransmit():
+            logging.error(f"{self.addr}: retries excedidos")
+            return self.cleanup()
+        self.rearm()
 
-    def handle_ack(self, seq):
+    def rearm(self):
+        # prazo: envio espaçado pendente, fim da janela de RESEND ou timeout do segmento
         st=self.state
-        if seq==st['current']:
-            st['current']+=1; st['retries']=0
-            self.send_next()
+        if self.pending: t=st.next_send_at
+        elif self.finished_at: t=max(self.finished_at,self.last_rx)+RECOVER_WIN
+        else: t=st.last_send+TIMEOUT
+        if t!=self.deadline:
+            self.deadline=t
+            # prazo adiado (o caso comum, a cada envio) não empilha entrada nova:
+            # a entrada atual é reagendada quando vencer; só antecipar empilha
+            if self.armed is None or t<self.armed:
+                self.armed=t
+                self.srv.schedule(t,self)
+
+    def fill(self):
+        # envia segmentos novos até WINDOW sem ACK; com PACING, cede ao laço
+        # (timer em next_send_at) em vez de dormir
+        st=self.state
+        st.next=max(st.next,st.base)
+        end=min(st.base+WINDOW,st.total)
+        while st.next<end:
+            if PACING:
+                if time.monotonic()<st.next_send_at:
+                    self.pending=True
+                    return
+                n=1
+            else: n=min(end-st.next,BATCH)
+            self.send_segments(range(st.next,st.next+n))
+            st.next+=n
+        self.prefetch()
+
+    def prefetch(self):
+        # adianta CRC (e a leitura das páginas) dos segmentos após a janela
+        # enquanto os ACKs estão em trânsito: quando a janela andar, só falta o
+        # sendmsg. Calcula em blocos de CRC_BLOCK quando a folga cai abaixo de um lote
+        st=self.state
+        if st.ready>=min(st.next+BATCH,st.total): return
+        lo=max(st.ready,st.next); hi=min(lo+CRC_BLOCK,st.total)
+        seg_crcs(st.mv,st.crc,st.have,st.total,lo,hi)
+        st.ready=hi
+
+    def send_segments(self, seqs):
+        # até BATCH segmentos num único sendmsg; só o último pode ser curto
+        st = self.state; tot = st.total; mv = st.mv; crcs = st.crc; have = st.have
+        slots = self.slots; put = _SEQ_SIZE.pack_into; iov = []
+        # seqs é crescente, então o segmento FLAG_LAST só pode vir no fim do lote
+        last = seqs[-1]==st.last_seq
+        if last: slots[len(seqs)-1][13] = FLAG_LAST
+        for k,i in enumerate(seqs):
+            chunk=mv[i*MAX_PAYLOAD:(i+1)*MAX_PAYLOAD]
+            h = slots[k]; put(h, 3, i, len(chunk))
+            if not have[i]:
+                _U32.pack_into(crcs, 4*i, zlib.crc32(chunk,zlib.crc32(h))); have[i] = 1
+            # scatter-gather: payload e CRC vão direto do mapeamento e da tabela
+            iov += (h, crcs[4*i:4*i+4], chunk)
+        self.srv.send_batch(iov, self.addr)
+        if last: slots[len(seqs)-1][13] = FLAG_NORMAL
+
+        st.last_send=now=time.monotonic()
+        st.next_send_at=now+PACING
+        if self.srv.debug: logging.debug(f"{self.addr}: enviados segs {seqs[0]}..{seqs[-1]}/{tot-1}")
+
+    def handle_ack(self, seq):
+        st=self.state; acked=st.acked; tot=st.total
+        if not 0<=seq<tot: return
+        acked[seq]=1
+        if seq!=st.base: return
+        # ACK da base: avança até o próximo sem ACK e abre espaço na janela
+        b=seq
+        while b<tot and acked[b]: b+=1
+        st.base=b; st.retries=0
+        if b>=tot:
+            # com a janela, o ACK de FLAG_LAST pode chegar antes de outros:
+            # a janela de RESEND só abre quando todos tiverem ACK
+            if not self.finished_at:
+                self.finished_at = time.monotonic()
+                logging.info(f"{self.addr}: todos os segmentos confirmados")
+        elif not self.pending:
+            # o fill fica para o fim do drain: vários ACKs do mesmo lote
+            # liberam vários slots, enviados juntos num só sendmsg
+            self.srv.refill[self.addr]=self
 
     def retransmit(self):
         st=self.state
-        if time.time()-st['last_send']<TIMEOUT: return True
-        if st['retries']>=MAX_RETRIES: return False
-        st['retries']+=1
-        logging.warning(f"{self.addr}: timeout seg {st['current']}, retry")
-        self.send_next()
+        if time.monotonic()-st.last_send<TIMEOUT: return True
+        if st.retries>=MAX_RETRIES: return False
+        st.retries+=1
+        # conta o próximo TIMEOUT a partir daqui mesmo que não haja o que reenviar
+        st.last_send=time.monotonic()
+        logging.warning(f"{self.addr}: timeout seg {st.base}, retry")
+        # reenvia só o que está na janela e ainda não teve ACK
+        acked=st.acked
+        lost=[i for i in range(st.base,st.next) if not acked[i]]
+        for k in range(0,len(lost),BATCH):
+            self.send_segments(lost[k:k+BATCH])
         return True
 
     def resend_segment(self, n):
-        st=self.state
-        if 0<=n<st['total']:
-            prev=st['current']; st['current']=n
-            self.send_next(); st['current']=prev
+        if 0<=n<self.state.total:
+            self.send_segments((n,))
 
     def cleanup(self):
         if self.state:
-            self.state['file'].close()
+            # mapeamento e tabela são do cache de map_file; só solta as views deste cliente
+            self.state.mv.release(); self.state.crc.release()
+        self.deadline=None
         self.srv.remove_client(self.addr)
         logging.info(f"{self.addr}: handler finalizado")
 
 
 class UDPServer:
-    def __init__(self, port:int):
+    def __init__(self, port:int, reuseport=False):
         self.socket=socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        if reuseport:
+            # vários processos na mesma porta; o kernel distribui por hash da
+            # 4-tupla, então cada cliente fica sempre no mesmo processo
+            self.socket.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEPORT,1)
         self.socket.bind(('',port))
+        self.socket.setblocking(False)
         self.directory='files'
         os.makedirs(self.directory,exist_ok=True)
-        self.queues:Dict[Tuple[str,int],queue.Queue]={}
-        logging.info(f"Servidor iniciado UDP 0.0.0.0:{port}, servindo 'files/'")
+        self.clients:Dict[Tuple[str,int],ClientHandler]={}
+        # heap de prazos (instante, desempate, handler), no máximo uma entrada
+        # viva por handler (handler.armed); as demais são descartadas ao sair
+        self.timers=[]
+        self.tiebreak=itertools.count()
+        self.refill={}   # addr -> handler com slots livres na janela, esvaziado em drain
+        self.rbuf=bytearray(HDR_SZ+MAX_PAYLOAD)   # buffer único de recepção
+        self.rmv=memoryview(self.rbuf)
+        self.gso=HAS_SENDMSG and sys.platform.startswith('linux')
+        # log por pacote só em DEBUG (-v)
+        self.debug=logging.getLogger().isEnabledFor(logging.DEBUG)
+        logging.info(f"Servidor iniciado UDP 0.0.0.0:{port}, servindo 'files/' (pid {os.getpid()})")
 
     def run(self):
+        sel=selectors.DefaultSelector()
+        sel.register(self.socket,selectors.EVENT_READ)
         while True:
+            timeout=max(0.0,self.timers[0][0]-time.monotonic()) if self.timers else None
+            if sel.select(timeout):
+                self.drain()
+            self.run_timers()
+
+    def drain(self):
+        # lê o que já chegou, limitado para não atrasar os timers; sempre no
+        # mesmo buffer, e os handlers recebem uma view válida só durante handle()
+        buf,mv=self.rbuf,self.rmv
+        for _ in range(RECV_BATCH):
             try:
-                data,addr=self.socket.recvfrom(HDR_SZ+MAX_PAYLOAD)
+                n,addr=self.socket.recvfrom_into(buf)
+            except BlockingIOError:
+                break
             except ConnectionResetError:
                 continue
-            if addr not in self.queues:
-                q=queue.Queue()
-                self.queues[addr]=q
-                ClientHandler(self,addr,q).start()
-            self.queues[addr].put(data)
+            # filtro barato nos bytes crus antes de qualquer unpack ou handler:
+            # runts, MAGIC errado e tipos que o servidor nunca recebe
+            if n<HDR_SZ or (buf[0]<<8|buf[1])!=MAGIC or buf[2] not in (TYPE_REQ,TYPE_ACK):
+                continue
+            h=self.clients.get(addr)
+            if h is None:
+                h=self.clients[addr]=ClientHandler(self,addr)
+            try:
+                h.handle(mv[:n])
+            except Exception:
+                # pacote malformado derruba só este cliente, não o laço
+                logging.exception(f"{addr}: erro tratando pacote")
+                h.cleanup()
+        # um fill por cliente com janela liberada neste lote
+        refill,self.refill=self.refill,{}
+        for addr,h in refill.items():
+            if self.clients.get(addr) is not h or h.pending: continue
+            try:
+                h.fill()
+                h.rearm()
+            except Exception:
+                logging.exception(f"{addr}: erro enviando janela")
+                h.cleanup()
+
+    def schedule(self,t,handler):
+        heapq.heappush(self.timers,(t,next(self.tiebreak),handler))
+
+    def run_timers(self):
+        now=time.monotonic()
+        while self.timers and self.timers[0][0]<=now:
+            t,_,h=heapq.heappop(self.timers)
+            if h.armed!=t: continue            # substituída por prazo mais cedo
+            if h.deadline is None:             # handler finalizado
+                h.armed=None
+            elif h.deadline>now:               # prazo foi adiado: reagenda
+                h.armed=h.deadline
+                self.schedule(h.deadline,h)
+            else:
+                # prazo consumido: zerar garante que o rearm de on_timer
+                # reagende mesmo quando nada foi enviado e o prazo se repete
+                h.armed=h.deadline=None
+                try:
+                    h.on_timer()
+                except Exception:
+                    # erro num envio por timer (EPERM, ENETUNREACH...) derruba
+                    # só este cliente, não o laço
+                    logging.exception(f"{h.addr}: erro no timer")
+                    h.cleanup()
 
     def remove_client(self,addr):
-        self.queues.pop(addr,None)
+        self.clients.pop(addr,None)
+
+    def sendmsg(self,parts,addr):
+        try:
+            if HAS_SENDMSG: self.socket.sendmsg(parts,[],0,addr)
+            else: self.socket.sendto(b''.join(parts),addr)
+        except BlockingIOError:
+            # buffer de envio cheio: conta como perda, o timeout/RESEND recupera
+            logging.warning(f"{addr}: buffer de envio cheio, pacote descartado")
+
+    def send_batch(self,iov,addr):
+        # iov = (cabeçalho, crc, payload) por segmento; com GSO vai tudo numa
+        # chamada e o kernel corta em datagramas de DGRAM_SZ bytes
+        if len(iov)>3 and self.gso:
+            try:
+                self.socket.sendmsg(iov,[(SOL_UDP,UDP_SEGMENT,_GSO)],0,addr)
+                return
+            except BlockingIOError:
+                logging.warning(f"{addr}: buffer de envio cheio, lote descartado")
+                return
+            except OSError as e:
+                # só falta de suporte desliga o GSO; EPERM, ENETUNREACH etc. são
+                # do destino e sobem para o handler, como num envio simples
+                if e.errno not in GSO_UNSUPPORTED: raise
+                logging.warning(f"UDP_SEGMENT indisponível, enviando um a um: {e}")
+                self.gso=False
+        for k in range(0,len(iov),3):
+            self.sendmsg(iov[k:k+3],addr)
 
     def send_error(self,addr,msg):
         p=msg.encode()
-        h=struct.pack('!HBIHIB',MAGIC,TYPE_ERR,0,len(p),0,0)
-        pkt=h+crc32(h+p)+p
-        self.socket.sendto(pkt,addr)
+        h=_HDR_NOCRC.pack(MAGIC,TYPE_ERR,0,len(p),0,0)
+        self.sendmsg([h,crc32(h,p),p],addr)
         logging.error(f"{addr}: erro '{msg}' enviado")
 
 
@@ -200,5 +458,30 @@ if __name__=='__main__':
     import argparse
     p=argparse.ArgumentParser()
     p.add_argument('port',type=int)
+    p.add_argument('-v','--verbose',action='store_true',help="log de cada pacote")
+    p.add_argument('-w','--workers',type=int,default=1,
+                   help="processos atendendo a porta com SO_REUSEPORT (Linux)")
     args=p.parse_args()
-    UDPServer(args.port).run()
+    if args.verbose: logging.getLogger().setLevel(logging.DEBUG)
+    if args.workers>1 and not HAS_REUSEPORT:
+        logging.warning("SO_REUSEPORT/fork indisponíveis, usando 1 processo")
+        args.workers=1
+    # cada processo tem seu próprio socket e laço: sem GIL nem estado compartilhado
+    workers=[]
+    for _ in range(args.workers-1):
+        pid=os.fork()
+        if pid==0: workers=[]; break
+        workers.append(pid)
+    if workers:
+        # no pai, SIGTERM/SIGINT viram SystemExit para passar pelo finally que
+        # encerra e recolhe os filhos
+        for sig in (signal.SIGTERM,signal.SIGINT):
+            signal.signal(sig,lambda sig,frame: sys.exit(0))
+    try:
+        UDPServer(args.port,reuseport=args.workers>1).run()
+    finally:
+        for pid in workers:
+            try: os.kill(pid,signal.SIGTERM)
+            except ProcessLookupError: pass
+        for pid in workers:
+            os.waitpid(pid,0)